@@ -1,11 +1,12 @@
 # app.py
 import os
+import re
 import tempfile
 import traceback
+from datetime import datetime
 from flask import Flask, request, render_template, jsonify
 import pandas as pd
 from pathlib import Path
-import importlib
 import src.config as config
 from src import main as cfe_main
 
@@ -47,16 +48,26 @@ def _parse_uploaded_file_to_dict(path: str) -> dict:
         traceback.print_exc()
     return data
 
+# (shape, format) pairs tried in order; strptime only runs on strings with a matching shape
+_DATE_FORMATS = [
+    (re.compile(r'^\d{1,2}/\d{1,2}/\d{4}$'), '%d/%m/%Y'),
+    (re.compile(r'^\d{4}-\d{1,2}-\d{1,2}$'), '%Y-%m-%d'),
+    (re.compile(r'^\d{1,2}-\d{1,2}-\d{4}$'), '%d-%m-%Y'),
+    (re.compile(r'^\d{1,2}\.\d{1,2}\.\d{4}$'), '%d.%m.%Y'),
+    (re.compile(r'^\d{1,2}/\d{1,2}/\d{4}$'), '%m/%d/%Y'),
+]
+
 def _parse_date(s: str):
     """Try to parse a date from common formats. Return datetime.date or None."""
     if not s:
         return None
     s = str(s).strip()
-    fmts = ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%d.%m.%Y', '%m/%d/%Y']
-    for f in fmts:
+    for shape, f in _DATE_FORMATS:
+        if not shape.match(s):
+            continue
         try:
-            return pd.to_datetime(s, format=f).date()
-        except Exception:
+            return datetime.strptime(s, f).date()
+        except ValueError:
             continue
     # fallback to pandas parsing
     try:
@@ -72,8 +83,9 @@ def index():
 def run_scraper():
     """
     Accepts an optional file upload containing key/value pairs (XLSX or TXT/CSV).
-    Applies overrides in-memory (does NOT write .env), validates date range (<=30 days),
-    forces HEADLESS True and runs the scraper synchronously (blocking).
+    Per-job keys (config.RUN_CONFIG_KEYS) override the environment for this request only
+    (does NOT write .env or os.environ), validates date range (<=30 days) and runs the
+    headless scraper synchronously (blocking).
     Returns JSON with 'ok' and 'output' or 'error'.
     """
     file = request.files.get('file')
@@ -89,14 +101,17 @@ def run_scraper():
         overrides = _parse_uploaded_file_to_dict(temp_path)
 
     try:
-        # reload config and apply overrides in-memory (no .env write)
-        importlib.reload(config)
-        if overrides:
-            config.override_from_dict(overrides)
+        # re-read .env; the job's own settings go into a per-request RunConfig and nothing
+        # from the upload is written to os.environ (the scraper always runs headless)
+        config.refresh()
+        cfg = config.run_config(overrides)
+        ignored = sorted(k for k in overrides if str(k).strip().upper() not in config.RUN_CONFIG_KEYS)
+        if ignored:
+            print("[WARN] Ignoring upload settings that cannot be set per job:", ", ".join(ignored))
 
         # Validate dates before launching browser
-        d_from_s = getattr(config, "ECF_FROM_DATE", "") or ""
-        d_to_s = getattr(config, "ECF_TO_DATE", "") or ""
+        d_from_s = cfg.date_from or ""
+        d_to_s = cfg.date_to or ""
         d_from = _parse_date(d_from_s)
         d_to = _parse_date(d_to_s)
         if d_from and d_to:
@@ -106,19 +121,14 @@ def run_scraper():
             if delta > 30:
                 return jsonify({'ok': False, 'error': 'Date range too large: max allowed is 30 days'}), 400
 
-        # Ensure HEADLESS enforced (do not open visible browser)
-        if not getattr(config, "HEADLESS", True):
-            config.HEADLESS = True
-            os.environ['HEADLESS'] = "true"
-
         # Run scraper synchronously
         try:
-            cfe_main.run()
+            cfe_main.run(cfg=cfg)
         except ValueError as ve:
             # Known validation errors (login failure etc) -> return 400 with message
             return jsonify({'ok': False, 'error': str(ve)}), 400
 
-        output_file = getattr(config, 'OUTPUT_FILE', None)
+        output_file = cfg.output_file
         return jsonify({'ok': True, 'output': output_file})
     except Exception as e:
         traceback.print_exc()
@@ -5,6 +5,7 @@ import os
 import re
 import urllib.parse
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional, Tuple, List
 import pandas as pd
@@ -13,6 +14,7 @@ from playwright.sync_api import TimeoutError, Error
 
 from src import selectors as sel
 from src import config
+from src.browser import new_blocked_page
 
 # ---------------------------
 # Debug / wait helpers
@@ -37,16 +39,12 @@ def _dump_debug(page, prefix="debug"):
 
 
 def _wait_for_url_contains(page, substring, timeout=60):
-    deadline = time.time() + timeout
-    while time.time() < deadline:
-        try:
-            url = getattr(page, "url", "") or ""
-        except Exception:
-            url = ""
-        if substring in url:
-            return True
-        time.sleep(0.5)
-    return False
+    """Block until the page URL contains substring (driven by navigation events, no polling)."""
+    try:
+        page.wait_for_url(lambda url: substring in url, wait_until="commit", timeout=timeout * 1000)
+        return True
+    except Exception:
+        return substring in (getattr(page, "url", "") or "")
 
 # ---------------------------
 # URL helpers & incremental persistence
@@ -65,13 +63,33 @@ def _canonicalize_url(url: str) -> str:
         return url.strip()
 
 
+# directories already created/verified by this process
+_ENSURED_DIRS: set = set()
+
+
+def ensure_dir(path) -> str:
+    """
+    mkdir -p once per process; later calls for the same path skip the syscall.
+    Only for run()'s top-level folders: anything written into later must not trust the memo,
+    since the folder can be deleted between jobs.
+    """
+    key = str(path)
+    if key and key not in _ENSURED_DIRS:
+        os.makedirs(key, exist_ok=True)
+        _ENSURED_DIRS.add(key)
+    return key
+
+
 def _append_row_to_csv(csv_path: str, row: dict, fieldnames: list):
     """Append a row to CSV (creates file + header if missing)."""
     write_header = not os.path.exists(csv_path)
-    out_dir = os.path.dirname(csv_path) or "."
-    if out_dir and not os.path.exists(out_dir):
-        os.makedirs(out_dir, exist_ok=True)
-    with open(csv_path, "a", newline="", encoding="utf-8") as f:
+    try:
+        f = open(csv_path, "a", newline="", encoding="utf-8")
+    except FileNotFoundError:
+        # folder missing (e.g. deleted while the job ran): recreate it instead of losing the row
+        os.makedirs(os.path.dirname(csv_path) or ".", exist_ok=True)
+        f = open(csv_path, "a", newline="", encoding="utf-8")
+    with f:
         writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
         if write_header:
             writer.writeheader()
@@ -112,21 +130,22 @@ def _find_continue_element(page, timeout=30):
     return None
 
 
-def login_and_continue(page, post_click_wait: int = 5, wait_for_selector: Optional[str] = None) -> Tuple[object, str]:
+def login_and_continue(page, post_click_wait: int = 5, wait_for_selector: Optional[str] = None,
+                       selector_timeout: int = 15000, cfg=None) -> Tuple[object, str]:
     """
     Login to the site, press Continue and then click the 'Consulta de CFE recibidos' entry.
+    wait_for_selector (searched in the page and its frames for up to selector_timeout ms)
+    marks the Consulta page as ready; post_click_wait adds a fixed sleep on top (0 = none).
+    cfg: optional config.RunConfig with the credentials; defaults to config.RUT/CLAVE.
     Returns (final_page, final_url).
     Raises ValueError on likely login failure (keeps behavior for caller to surface).
     """
     try:
-        print("[INFO] Waiting for initial page load (networkidle)...")
+        print("[INFO] Waiting for initial page load (domcontentloaded)...")
         try:
-            page.wait_for_load_state("networkidle", timeout=60000)
+            page.wait_for_load_state("domcontentloaded", timeout=30000)
         except Exception:
-            try:
-                page.wait_for_load_state("load", timeout=30000)
-            except Exception:
-                print("[WARN] initial load didn't reach networkidle/load - continuing")
+            print("[WARN] initial load didn't reach domcontentloaded - continuing")
 
         target = None
         try:
@@ -136,7 +155,7 @@ def login_and_continue(page, post_click_wait: int = 5, wait_for_selector: Option
             print("[INFO] Found main page login inputs.")
         except TimeoutError:
             print("[INFO] Main page inputs not found; trying iframe...")
-            iframe_el = page.query_selector('iframe[src*="loginProd"]') or page.query_selector("iframe")
+            iframe_el = page.query_selector(sel.LOGIN_IFRAME) or page.query_selector("iframe")
             if iframe_el:
                 frame = iframe_el.content_frame()
                 if frame:
@@ -146,9 +165,9 @@ def login_and_continue(page, post_click_wait: int = 5, wait_for_selector: Option
                 raise Exception("Login inputs not found on main page or in iframe.")
 
         print("[INFO] Filling username...")
-        target.fill(sel.USERNAME_INPUT, str(config.RUT))
+        target.fill(sel.USERNAME_INPUT, str(cfg.rut if cfg is not None else config.RUT))
         print("[INFO] Filling password...")
-        target.fill(sel.PASSWORD_INPUT, str(config.CLAVE))
+        target.fill(sel.PASSWORD_INPUT, str(cfg.clave if cfg is not None else config.CLAVE))
 
         print("[INFO] Clicking login button...")
         try:
@@ -275,12 +294,6 @@ def login_and_continue(page, post_click_wait: int = 5, wait_for_selector: Option
                 final_url = getattr(page, "url", "")
             print("[INFO] After Continue (same page):", final_url)
 
-        if wait_for_selector:
-            try:
-                final_page.wait_for_selector(wait_for_selector, timeout=post_click_wait * 1000)
-            except Exception:
-                print("[WARN] wait_for_selector did not appear in time.")
-
         # Now click 'Consulta de CFE recibidos'
         print("[INFO] Clicking 'Consulta de CFE recibidos' ...")
         try:
@@ -302,7 +315,14 @@ def login_and_continue(page, post_click_wait: int = 5, wait_for_selector: Option
             except Exception:
                 pass
 
-        time.sleep(post_click_wait)
+        # wait for the Consulta form instead of a fixed sleep; the helper polls the page and
+        # its frames every 200 ms (the form can sit in any frame, wait_for_selector watches one)
+        if wait_for_selector:
+            _, ready_el = _find_element_in_page_and_frames(final_page, wait_for_selector, timeout=selector_timeout)
+            if not ready_el:
+                print("[WARN] wait_for_selector did not appear in time.")
+        if post_click_wait:
+            time.sleep(post_click_wait)
         return final_page, final_url
 
     except ValueError:
@@ -319,6 +339,81 @@ def login_and_continue(page, post_click_wait: int = 5, wait_for_selector: Option
         _dump_debug(page)
         raise
 
+# ---------------------------
+# Session reuse (Playwright storage_state)
+# ---------------------------
+def _credential_salt(salt_dir) -> bytes:
+    """Random per-install salt kept next to the saved sessions (created on first use, mode 0600)."""
+    path = Path(salt_dir) / ".credential_salt"
+    os.makedirs(path.parent, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(16))
+    return path.read_bytes()
+
+
+def credential_key(rut: str, clave: str, salt_dir: str = ".cache") -> str:
+    """
+    Filesystem-safe '<RUT>_<hash>' for per-login artifacts (saved session, browser profile).
+    The hash is a salted PBKDF2 of RUT+CLAVE, so a saved login is only found again with the
+    same password: a wrong CLAVE misses it and goes through the real login check.
+    """
+    import hashlib
+    safe = re.sub(r"[^0-9A-Za-z_-]", "_", str(rut).strip()) or "default"
+    digest = hashlib.pbkdf2_hmac("sha256", f"{rut}\0{clave}".encode("utf-8"), _credential_salt(salt_dir), 100_000)
+    return f"{safe}_{digest.hex()[:16]}"
+
+
+def storage_state_path(rut: str, clave: str, cache_dir: str = ".cache") -> Path:
+    """Per-login (RUT + CLAVE) file holding the logged-in context's cookies/localStorage."""
+    return Path(cache_dir) / f"storage_state_{credential_key(rut, clave, cache_dir)}.json"
+
+
+def fresh_storage_state(path, ttl_seconds: float) -> Optional[str]:
+    """Return str(path) if the saved state exists and is younger than ttl_seconds, else None."""
+    try:
+        if time.time() - os.stat(path).st_mtime < ttl_seconds:
+            return str(path)
+    except OSError:
+        pass
+    return None
+
+
+def save_storage_state(ctx, path) -> None:
+    """Persist the context's auth state after a successful login (best effort)."""
+    try:
+        os.makedirs(Path(path).parent, exist_ok=True)
+        ctx.storage_state(path=str(path))
+        # session cookies: readable by this user only
+        os.chmod(path, 0o600)
+        print(f"[INFO] Saved login session to {path}")
+    except Exception as e:
+        print("[WARN] Could not save login session:", e)
+
+
+def resume_session(page, consulta_url: str, timeout: int = 3000) -> bool:
+    """
+    Open the Consulta page with the restored session and probe for the tipo CFE select
+    (polled in the page and its frames for up to timeout ms).
+    True means the session is still valid and page is ready for fill_cfe_and_consult.
+    """
+    try:
+        print(f"[INFO] Trying saved session: {consulta_url}")
+        page.goto(consulta_url, wait_until="domcontentloaded", timeout=30000)
+    except Exception as e:
+        print("[WARN] Navigation with saved session failed:", e)
+        return False
+    _, el = _find_element_in_page_and_frames(page, sel.SELECT_TIPO_CFE, timeout=timeout)
+    if el is None:
+        print("[INFO] Saved session not accepted; logging in.")
+        return False
+    return True
+
+
 # ---------------------------
 # Fill filters / Consult
 # ---------------------------
@@ -338,6 +433,7 @@ def _click_maybe_in_frames(page, selector, timeout=2000):
 
 
 def _find_element_in_page_and_frames(page, selector, timeout=5000):
+    """Poll the page and all its frames every 200 ms until selector matches; (None, None) on timeout."""
     deadline = time.time() + (timeout / 1000)
     while time.time() < deadline:
         try:
@@ -539,35 +635,37 @@ def _sanitize_fecha_emision(value: str) -> str:
     return v[:-5] if len(v) > 5 else ""
 
 
-def _extract_fields_from_page(p):
-    mapping = {
-        "Razon Social": ["#span_vDENOMINACION", '[id*="span_vDENOMINACION"]', '.ReadonlyAttribute#span_vDENOMINACION'],
-        "RUT": ["#span_CTLEFACARCHEMISORDOCNRO", '[id*="CTLEFACARCHEMISORDOCNRO"]'],
-        "Tipo CFE": ["#span_CTLEFACCMPTIPODESCORTA", '[id*="CTLEFACCMPTIPODESCORTA"]'],
-        "Serie": ["#span_CTLEFACCFESERIE1", '[id*="CTLEFACCFESERIE1"]'],
-        "Numero": ["#span_CTLEFACCFENUMERO1", '[id*="CTLEFACCFENUMERO1"]'],
-        "Fecha de Emision": ["#CTLEFACCFEFIRMAFECHAHORA_dp_container", '[id*="CTLEFACCFEFIRMAFECHAHORA"]', '[id*="FECHAHORA"]'],
-        "Moneda": ["#span_CTLEFACCFETIPOMONEDA", '[id*="CTLEFACCFETIPOMONEDA"]'],
-        "TC": ["#span_CTLEFACCFETIPOCAMBIO", '[id*="CTLEFACCFETIPOCAMBIO"]', '[id*="TIPOCAMBIO"]'],
-        "Monto No Gravado": ["#span_CTLEFACCFETOTALMONTONOGRV", '[id*="TOTALMONTONOGRV"]'],
-        "Monto Exportacion y Asimilados": ["#span_CTLEFACCFETOTALMONTONOGRV", '[id*="TOTALMONTONOGRV"]'],
-        "Monto Impuesto Percibido": ["#span_CTLEFACCFETOTALMNTIMPPER", '[id*="TOTALMNTIMPPER"]'],
-        "Monto  IVA en suspenso": ["#span_CTLEFACCFETOTALMNTIVASUSP", '[id*="TOTALMNTIVASUSP"]'],
-        "Neto Iva Tasa Basica": ["#span_CTLEFACCFETOTALMNTNETOIVATTB", '[id*="TOTALMNTNETOIVATTB"]'],
-        "Neto Iva Tasa Minima": ["#span_CTLEFACCFETOTALMNTNETOIVATTM", '[id*="TOTALMNTNETOIVATTM"]'],
-        "Neto Iva Otra Tasa": ["#span_CTLEFACCFETOTALMNTNETOIVATTO", '[id*="TOTALMNTNETOIVATTO"]'],
-        "Monto Total": ["#span_CTLEFACCFETOTALMONTOTOTAL", '[id*="TOTALMONTOTOTAL"]'],
-        "Monto Retenido": ['#span_CTLEFACCFETOTALMONTORET', '[id*="CTLEFACCFETOTALMONTORET"]', '.TextView#TEXTBLOCK64'],
-        "Monto Credito Fiscal": ["#span_CTLEFACCFETOTALMONTCREDFISC", '[id*="TOTALMONTCREDFISC"]'],
-        "Monto No facturable": ["#span_CTLEFACCFEMONTONOFACT", '[id*="MONTONOFACT"]'],
-        "Monto Total a Pagar": ["#span_CTLEFACCFETOTALMNTAPAGAR", '[id*="TOTALMNTAPAGAR"]'],
-        "Iva Tasa Basica": ["#span_CTLEFACCFETOTALIVATASABASICA", '[id*="TOTALIVATASABASICA"]'],
-        "Iva Tasa Minima": ["#span_CTLEFACCFETOTALIVATASAMIN", '[id*="TOTALIVATASAMIN"]'],
-        "Iva Otra Tasa": ['#span_CTLEFACCFETOTALIVAOTRATASA', '[id*="TOTALIVAOTRATASA"]'],
-    }
+# column -> candidate selectors on the CFE detail page (first non-empty match wins)
+_FIELD_SELECTORS = {
+    "Razon Social": ["#span_vDENOMINACION", '[id*="span_vDENOMINACION"]', '.ReadonlyAttribute#span_vDENOMINACION'],
+    "RUT": ["#span_CTLEFACARCHEMISORDOCNRO", '[id*="CTLEFACARCHEMISORDOCNRO"]'],
+    "Tipo CFE": ["#span_CTLEFACCMPTIPODESCORTA", '[id*="CTLEFACCMPTIPODESCORTA"]'],
+    "Serie": ["#span_CTLEFACCFESERIE1", '[id*="CTLEFACCFESERIE1"]'],
+    "Numero": ["#span_CTLEFACCFENUMERO1", '[id*="CTLEFACCFENUMERO1"]'],
+    "Fecha de Emision": ["#CTLEFACCFEFIRMAFECHAHORA_dp_container", '[id*="CTLEFACCFEFIRMAFECHAHORA"]', '[id*="FECHAHORA"]'],
+    "Moneda": ["#span_CTLEFACCFETIPOMONEDA", '[id*="CTLEFACCFETIPOMONEDA"]'],
+    "TC": ["#span_CTLEFACCFETIPOCAMBIO", '[id*="CTLEFACCFETIPOCAMBIO"]', '[id*="TIPOCAMBIO"]'],
+    "Monto No Gravado": ["#span_CTLEFACCFETOTALMONTONOGRV", '[id*="TOTALMONTONOGRV"]'],
+    "Monto Exportacion y Asimilados": ["#span_CTLEFACCFETOTALMONTONOGRV", '[id*="TOTALMONTONOGRV"]'],
+    "Monto Impuesto Percibido": ["#span_CTLEFACCFETOTALMNTIMPPER", '[id*="TOTALMNTIMPPER"]'],
+    "Monto  IVA en suspenso": ["#span_CTLEFACCFETOTALMNTIVASUSP", '[id*="TOTALMNTIVASUSP"]'],
+    "Neto Iva Tasa Basica": ["#span_CTLEFACCFETOTALMNTNETOIVATTB", '[id*="TOTALMNTNETOIVATTB"]'],
+    "Neto Iva Tasa Minima": ["#span_CTLEFACCFETOTALMNTNETOIVATTM", '[id*="TOTALMNTNETOIVATTM"]'],
+    "Neto Iva Otra Tasa": ["#span_CTLEFACCFETOTALMNTNETOIVATTO", '[id*="TOTALMNTNETOIVATTO"]'],
+    "Monto Total": ["#span_CTLEFACCFETOTALMONTOTOTAL", '[id*="TOTALMONTOTOTAL"]'],
+    "Monto Retenido": ['#span_CTLEFACCFETOTALMONTORET', '[id*="CTLEFACCFETOTALMONTORET"]', '.TextView#TEXTBLOCK64'],
+    "Monto Credito Fiscal": ["#span_CTLEFACCFETOTALMONTCREDFISC", '[id*="TOTALMONTCREDFISC"]'],
+    "Monto No facturable": ["#span_CTLEFACCFEMONTONOFACT", '[id*="MONTONOFACT"]'],
+    "Monto Total a Pagar": ["#span_CTLEFACCFETOTALMNTAPAGAR", '[id*="TOTALMNTAPAGAR"]'],
+    "Iva Tasa Basica": ["#span_CTLEFACCFETOTALIVATASABASICA", '[id*="TOTALIVATASABASICA"]'],
+    "Iva Tasa Minima": ["#span_CTLEFACCFETOTALIVATASAMIN", '[id*="TOTALIVATASAMIN"]'],
+    "Iva Otra Tasa": ['#span_CTLEFACCFETOTALIVAOTRATASA', '[id*="TOTALIVAOTRATASA"]'],
+}
+
 
+def _extract_fields_from_page(p):
     result = {}
-    for col, selectors in mapping.items():
+    for col, selectors in _FIELD_SELECTORS.items():
         found_text = ""
         for s in selectors:
             try:
@@ -973,7 +1071,7 @@ def export_xls_and_save(page, save_dir="downloads", timeout=30000, filename_pref
         download = download_ctx.value
         suggested = download.suggested_filename or "export.xls"
         # ensure save dir exists
-        Path(save_dir).mkdir(parents=True, exist_ok=True)
+        os.makedirs(save_dir, exist_ok=True)
 
         # build destination name using optional prefix + timestamp to avoid collisions
         ts = datetime.now().strftime("%Y%m%d%H%M%S")
@@ -995,15 +1093,169 @@ def export_xls_and_save(page, save_dir="downloads", timeout=30000, filename_pref
         return None
 
 # ---------------------------
-# process current page and append rows to CSV/Excel
+# process current page and append rows to CSV
 # ---------------------------
+def _extract_detail_data(detail_page) -> dict:
+    """Extract the CFE fields from an opened detail page (or the frame holding them), Fecha de Emision sanitized."""
+    extraction_target = detail_page
+    try:
+        for f in getattr(detail_page, 'frames', []):
+            if f.query_selector('#span_vDENOMINACION') or f.query_selector('[id*="CTLEFACCFETOTALMONTOTOTAL"]'):
+                extraction_target = f
+                break
+    except Exception:
+        pass
+
+    data = _extract_fields_from_page(extraction_target)
+    # sanitize Fecha de Emision (remove last 5 chars)
+    if "Fecha de Emision" in data:
+        data["Fecha de Emision"] = _sanitize_fecha_emision(data["Fecha de Emision"])
+    # compatibility: if extraction used misspelled key
+    if "Fecha de Emisin" in data and not data.get("Fecha de Emision"):
+        data["Fecha de Emision"] = _sanitize_fecha_emision(data.get("Fecha de Emisin", ""))
+    return data
+
+
+def _store_row(csv_path: str, cols_order: List[str], data: dict, url: str, canon: str, processed: set) -> bool:
+    """Append one extracted detail row to the CSV and mark its URL processed."""
+    # keep source URL for dedupe/debug as requested
+    data['h_source_url'] = url
+
+    # ensure all columns exist
+    for c in cols_order:
+        if c not in data:
+            data[c] = ''
+
+    try:
+        _append_row_to_csv(csv_path, data, fieldnames=cols_order)
+        processed.add(canon)
+        print(f"[INFO] Appended row for {url}")
+        return True
+    except Exception as e:
+        print("[ERROR] Could not append row:", e)
+        return False
+
+
+# ---------------------------
+# HTTP detail fetch: requests.Session reusing the browser's login cookies
+# ---------------------------
+_DETAIL_MARKERS = ('span_vDENOMINACION', 'CTLEFACCFETOTALMONTOTOTAL')
+# Detail pages fetched concurrently over HTTP (requests releases the GIL on socket reads)
+# when MAX_CONCURRENCY is not set; browser tabs default to 2 (see config.get_max_concurrency).
+HTTP_WORKERS_DEFAULT = 12
+
+
+def _http_workers(max_concurrency: Optional[int] = None) -> int:
+    return max(1, max_concurrency or config.get_max_concurrency(HTTP_WORKERS_DEFAULT))
+
+
+def build_http_session(page, max_concurrency: Optional[int] = None):
+    """Return a requests.Session carrying the page context's cookies and the browser User-Agent."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    # one pooled connection per worker thread
+    workers = _http_workers(max_concurrency)
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    for c in page.context.cookies():
+        session.cookies.set(c["name"], c["value"], domain=c.get("domain"), path=c.get("path") or "/")
+    try:
+        session.headers["User-Agent"] = page.evaluate("() => navigator.userAgent")
+    except Exception:
+        pass
+    return session
+
+
+def _extract_fields_from_html(html: str) -> dict:
+    """Same lookup as _extract_fields_from_page, against server-rendered HTML."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    result = {}
+    for col, selectors in _FIELD_SELECTORS.items():
+        found_text = ""
+        for s in selectors:
+            try:
+                el = soup.select_one(s)
+            except Exception:
+                el = None
+            if el is not None:
+                if el.name in ("input", "textarea"):
+                    found_text = (el.get("value") or el.get_text() or "").strip()
+                else:
+                    found_text = el.get_text().strip()
+                if found_text:
+                    break
+        result[col] = found_text
+    return result
+
+
+def _fetch_detail_http(session, url: str, timeout: int = 30) -> Optional[dict]:
+    """
+    Fetch and extract a detail page over HTTP, following one iframe level like the browser path.
+    Returns None when the response is not a usable detail page (e.g. redirected to login),
+    so the caller can fall back to the browser.
+    """
+    try:
+        resp = session.get(url, timeout=timeout)
+        resp.raise_for_status()
+        html = resp.text
+        if not any(m in html for m in _DETAIL_MARKERS):
+            from bs4 import BeautifulSoup
+            iframe_srcs = [f.get("src") for f in BeautifulSoup(html, "html.parser").select("iframe[src]")]
+            html = None
+            for src in iframe_srcs:
+                r = session.get(urllib.parse.urljoin(resp.url, src), timeout=timeout)
+                if r.ok and any(m in r.text for m in _DETAIL_MARKERS):
+                    html = r.text
+                    break
+            if html is None:
+                return None
+        data = _extract_fields_from_html(html)
+    except Exception as e:
+        print("[WARN] HTTP detail fetch failed:", url, e)
+        return None
+    if not any(data.values()):
+        return None
+    # sanitize Fecha de Emision (remove last 5 chars), as in _extract_detail_data
+    data["Fecha de Emision"] = _sanitize_fecha_emision(data.get("Fecha de Emision", ""))
+    return data
+
+
+def _open_and_extract(ctx, url: str) -> dict:
+    """Open url in a fresh tab of ctx, wait for load and extract the detail fields."""
+    detail_page = new_blocked_page(ctx)
+    try:
+        detail_page.goto(url, timeout=30000)
+        try:
+            detail_page.wait_for_load_state("load", timeout=20000)
+        except Exception:
+            pass
+        return _extract_detail_data(detail_page)
+    finally:
+        try:
+            detail_page.close()
+        except Exception:
+            pass
+
+
 def process_and_save_current_page(page, processed: set, csv_path: str, cols_order: List[str],
                                   parent_selector: Optional[str] = None, link_selector: Optional[str] = None,
-                                  wait_for_new_seconds: float = 6.0) -> int:
+                                  wait_for_new_seconds: float = 6.0, detail_context=None, http_session=None,
+                                  max_concurrency: Optional[int] = None) -> int:
     """
     Process the current page: wait until the page grid yields new (unprocessed) URLs or
     until wait_for_new_seconds timeout, then extract and append rows.
 
+    detail_context: optional BrowserContext (e.g. JavaScript disabled) used to open the detail
+    URLs; defaults to the grid page's context. Rows that come back empty from it are
+    re-extracted in the grid page's context.
+    http_session: optional requests.Session (see build_http_session); detail pages are fetched
+    over plain HTTP first and only the ones that fail go through the browser.
+    max_concurrency: detail pages in flight at once (browser tabs / HTTP workers); defaults to
+    config MAX_CONCURRENCY.
+
     Returns number of new rows added.
     """
     start = time.time()
@@ -1040,17 +1292,59 @@ def process_and_save_current_page(page, processed: set, csv_path: str, cols_orde
         except Exception:
             fallback_elements = []
 
-    # Process URL list first
+    # Process URL list first: detail pages are opened `tabs` at a time (as tabs of the
+    # logged-in context) so their loads overlap, then extracted one by one in grid order.
+    tabs = max(1, max_concurrency or config.get_max_concurrency())
+    pending = []
+    seen = set()
     for idx, url in enumerate(urls, start=1):
         canon = _canonicalize_url(url)
-        if canon in processed:
+        if canon in processed or canon in seen:
             print(f"[INFO] URL already processed; skipping: {url}")
             continue
-        print(f"[INFO] Opening URL {idx}/{len(urls)}: {url}")
-        try:
-            new_page = page.context.new_page()
+        seen.add(canon)
+        pending.append((idx, url, canon))
+
+    if http_session is not None and pending:
+        browser_pending = []
+        workers = _http_workers(max_concurrency)
+        print(f"[INFO] Fetching {len(pending)} detail page(s) over HTTP ({workers} workers)")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # fetches run in the pool; rows are written here, in grid order
+            results = list(pool.map(lambda item: _fetch_detail_http(http_session, item[1]), pending))
+        for (idx, url, canon), data in zip(pending, results):
+            if data is None:
+                browser_pending.append((idx, url, canon))
+            elif _store_row(csv_path, cols_order, data, url, canon, processed):
+                new_rows += 1
+        if browser_pending:
+            print(f"[INFO] {len(browser_pending)} detail page(s) not available over HTTP; using the browser.")
+        pending = browser_pending
+
+    detail_ctx = detail_context or page.context
+    for batch_start in range(0, len(pending), tabs):
+        opened = []
+        for idx, url, canon in pending[batch_start:batch_start + tabs]:
+            print(f"[INFO] Opening URL {idx}/{len(urls)}: {url}")
+            new_page = None
+            try:
+                new_page = new_blocked_page(detail_ctx)
+                try:
+                    # 'commit' returns as soon as the response starts, so the next tab can start loading
+                    new_page.goto(url, wait_until="commit", timeout=30000)
+                except Exception:
+                    pass
+                opened.append((url, canon, new_page))
+            except Exception as e:
+                print("[ERROR] Error opening URL:", url, e)
+                try:
+                    if new_page:
+                        new_page.close()
+                except Exception:
+                    pass
+
+        for url, canon, new_page in opened:
             try:
-                new_page.goto(url, timeout=30000)
                 try:
                     new_page.wait_for_load_state("load", timeout=20000)
                 except Exception:
@@ -1058,53 +1352,21 @@ def process_and_save_current_page(page, processed: set, csv_path: str, cols_orde
                         new_page.wait_for_load_state("networkidle", timeout=20000)
                     except Exception:
                         pass
-            except Exception:
-                pass
-
-            extraction_target = new_page
-            try:
-                for f in getattr(new_page, 'frames', []):
-                    if f.query_selector('#span_vDENOMINACION') or f.query_selector('[id*="CTLEFACCFETOTALMONTOTOTAL"]'):
-                        extraction_target = f
-                        break
-            except Exception:
-                pass
-
-            data = _extract_fields_from_page(extraction_target)
-            # sanitize Fecha de Emision (remove last 5 chars)
-            if "Fecha de Emision" in data:
-                data["Fecha de Emision"] = _sanitize_fecha_emision(data["Fecha de Emision"])
-            # compatibility: if extraction used misspelled key
-            if "Fecha de Emisin" in data and not data.get("Fecha de Emision"):
-                data["Fecha de Emision"] = _sanitize_fecha_emision(data.get("Fecha de Emisin", ""))
-
-            # keep source URL for dedupe/debug as requested
-            data['h_source_url'] = url
 
-            # ensure all columns exist
-            for c in cols_order:
-                if c not in data:
-                    data[c] = ''
-
-            try:
-                _append_row_to_csv(csv_path, data, fieldnames=cols_order)
-                processed.add(canon)
-                new_rows += 1
-                print(f"[INFO] Appended row for {url}")
+                data = _extract_detail_data(new_page)
+                if detail_ctx is not page.context and not any(data.values()):
+                    # this detail page needs scripts to render its fields
+                    print(f"[INFO] No fields without JavaScript; retrying in the main context: {url}")
+                    data = _open_and_extract(page.context, url)
+                if _store_row(csv_path, cols_order, data, url, canon, processed):
+                    new_rows += 1
             except Exception as e:
-                print("[ERROR] Could not append row:", e)
-
-            try:
-                new_page.close()
-            except Exception:
-                pass
-        except Exception as e:
-            print("[ERROR] Error opening URL:", url, e)
-            try:
-                new_page.close()
-            except Exception:
-                pass
-            continue
+                print("[ERROR] Error opening URL:", url, e)
+            finally:
+                try:
+                    new_page.close()
+                except Exception:
+                    pass
 
     # If URL list gave nothing or didn't yield new rows, process fallback element-clicks
     if new_rows == 0 and fallback_elements:
@@ -1127,21 +1389,7 @@ def process_and_save_current_page(page, processed: set, csv_path: str, cols_orde
                 if not opened_page:
                     continue
 
-                extraction_target = opened_page
-                try:
-                    for f in getattr(opened_page, 'frames', []):
-                        if f.query_selector('#span_vDENOMINACION') or f.query_selector('[id*="CTLEFACCFETOTALMONTOTOTAL"]'):
-                            extraction_target = f
-                            break
-                except Exception:
-                    pass
-
-                data = _extract_fields_from_page(extraction_target)
-                # sanitize Fecha de Emision before saving
-                if "Fecha de Emision" in data:
-                    data["Fecha de Emision"] = _sanitize_fecha_emision(data["Fecha de Emision"])
-                if "Fecha de Emisin" in data and not data.get("Fecha de Emision"):
-                    data["Fecha de Emision"] = _sanitize_fecha_emision(data.get("Fecha de Emisin", ""))
+                data = _extract_detail_data(opened_page)
 
                 src_url = getattr(opened_page, 'url', '') or ''
                 data['h_source_url'] = src_url
@@ -1172,46 +1420,33 @@ def process_and_save_current_page(page, processed: set, csv_path: str, cols_orde
                 print("[WARN] Exception during fallback element processing:", e)
                 continue
 
-    # Best-effort: update Excel after processing this page
-    try:
-        if os.path.exists(csv_path):
-            final_df = pd.read_csv(csv_path)
-            try:
-                xlsx_path = os.path.splitext(csv_path)[0] + ".xlsx"
-                # sanitize Fecha de Emision column in final_df (defensive)
-                if "Fecha de Emision" in final_df.columns:
-                    final_df["Fecha de Emision"] = final_df["Fecha de Emision"].fillna("").astype(str).apply(lambda s: s[:-5] if len(s) > 5 else "")
-                final_df.to_excel(xlsx_path, index=False)
-                print(f"[INFO] Saved {len(final_df)} rows to {xlsx_path} (intermediate).")
-            except Exception as e:
-                print("[WARN] Could not save intermediate Excel:", e)
-    except Exception as e:
-        print("[WARN] Could not convert CSV to Excel / read CSV during intermediate save:", e)
-
     return new_rows
 
 
 # ---------------------------
 # collect_cfe_from_links: multi-page, uses click_next_only for in-place pagination
 # ---------------------------
+# (format, precompiled shape) pairs for _normalize_date_for_folder
+_FOLDER_DATE_PATTERNS = [
+    ("%d/%m/%Y", re.compile(r"\d{2}/\d{2}/\d{4}")),
+    ("%Y-%m-%d", re.compile(r"\d{4}-\d{2}-\d{2}")),
+    ("%d-%m-%Y", re.compile(r"\d{2}-\d{2}-\d{4}")),
+    ("%d.%m.%Y", re.compile(r"\d{2}\.\d{2}\.\d{4}")),
+    ("%m/%d/%Y", re.compile(r"\d{2}/\d{2}/\d{4}")),
+]
+
 def _normalize_date_for_folder(s: str) -> str:
     """Convert various date formats into DD-MM-YYYY (best-effort). If not parseable, sanitize digits."""
     if not s:
         return ""
     s = s.strip()
     # try common formats
-    patterns = [
-        ("%d/%m/%Y", r"\d{2}/\d{2}/\d{4}"),
-        ("%Y-%m-%d", r"\d{4}-\d{2}-\d{2}"),
-        ("%d-%m-%Y", r"\d{2}-\d{2}-\d{4}"),
-        ("%d.%m.%Y", r"\d{2}\.\d{2}\.\d{4}"),
-        ("%m/%d/%Y", r"\d{2}/\d{2}/\d{4}"),
-    ]
-    for fmt, pat in patterns:
+    for fmt, pat in _FOLDER_DATE_PATTERNS:
+        if not pat.match(s):
+            continue
         try:
-            if re.match(pat, s):
-                dt = datetime.strptime(s, fmt)
-                return dt.strftime("%d-%m-%Y")
+            dt = datetime.strptime(s, fmt)
+            return dt.strftime("%d-%m-%Y")
         except Exception:
             continue
     # try to extract numbers and reformat dd-mm-yyyy if possible
@@ -1231,11 +1466,16 @@ def _normalize_date_for_folder(s: str) -> str:
     return re.sub(r"[^\d\-]", "-", s)
 
 def collect_cfe_from_links(page, link_selector: Optional[str] = None, output_file: str = "results.xlsx", parent_selector: Optional[str]=None,
-                           do_post_action: bool = True, max_pages: Optional[int] = None) -> str:
+                           do_post_action: bool = True, max_pages: Optional[int] = None, detail_context=None,
+                           http_session=None, max_concurrency: Optional[int] = None, cfg=None) -> str:
     """
     Main function: find document links in the grid (or using link_selector),
-    extract fields and save incrementally to CSV/Excel for each page, and paginate by clicking Next in-place.
+    extract fields and append each row to result.csv as soon as it is extracted, and paginate by clicking Next in-place.
+    result.xlsx is written once from the CSV at the end.
     Returns output_file path on success (Excel if able to write, otherwise CSV).
+    detail_context, http_session and max_concurrency are passed through to
+    process_and_save_current_page. cfg (config.RunConfig) supplies the RUT and dates used
+    for the output folders; defaults to the module config.
 
     NEW behavior: output structure:
       <base_dir>/
@@ -1249,13 +1489,13 @@ def collect_cfe_from_links(page, link_selector: Optional[str] = None, output_fil
 
     # base directory where OUTPUT_FILE normally lives
     base_dir = os.path.dirname(output_file) or "."
-    rut_val = str(getattr(config, "RUT", "")).strip() or "unknown_rut"
+    rut_val = str(cfg.rut if cfg is not None else getattr(config, "RUT", "")).strip() or "unknown_rut"
     rut_dir = os.path.join(base_dir, rut_val)
     os.makedirs(rut_dir, exist_ok=True)
 
     # build duration folder name
-    d_from_raw = getattr(config, "ECF_FROM_DATE", "") or ""
-    d_to_raw = getattr(config, "ECF_TO_DATE", "") or ""
+    d_from_raw = (cfg.date_from if cfg is not None else getattr(config, "ECF_FROM_DATE", "")) or ""
+    d_to_raw = (cfg.date_to if cfg is not None else getattr(config, "ECF_TO_DATE", "")) or ""
     if d_from_raw and d_to_raw:
         d_from_norm = _normalize_date_for_folder(d_from_raw)
         d_to_norm = _normalize_date_for_folder(d_to_raw)
@@ -1311,7 +1551,7 @@ def collect_cfe_from_links(page, link_selector: Optional[str] = None, output_fil
     # 1) Process current page first
     page_count += 1
     print(f"[INFO] Processing initial page (page {page_count}) ...")
-    new_on_page = process_and_save_current_page(page, processed, csv_path, cols_order, parent_selector=parent_selector, link_selector=link_selector)
+    new_on_page = process_and_save_current_page(page, processed, csv_path, cols_order, parent_selector=parent_selector, link_selector=link_selector, detail_context=detail_context, http_session=http_session, max_concurrency=max_concurrency)
     rows_added += new_on_page
     print(f"[INFO] New rows from initial page: {new_on_page}")
 
@@ -1339,12 +1579,11 @@ def collect_cfe_from_links(page, link_selector: Optional[str] = None, output_fil
             print("[WARN] Could not click Next — stopping pagination.")
             break
 
-        # small grace before scraping — process_and_save_current_page will poll for new items
-        time.sleep(0.2)
+        # no fixed grace sleep: process_and_save_current_page polls until the new rows show up
 
         page_count += 1
         print(f"[INFO] Processing page {page_count} ...")
-        new_on_page = process_and_save_current_page(page, processed, csv_path, cols_order, parent_selector=parent_selector, link_selector=link_selector)
+        new_on_page = process_and_save_current_page(page, processed, csv_path, cols_order, parent_selector=parent_selector, link_selector=link_selector, detail_context=detail_context, http_session=http_session, max_concurrency=max_concurrency)
         rows_added += new_on_page
         print(f"[INFO] New rows from page {page_count}: {new_on_page}")
 
@@ -1389,12 +1628,15 @@ def collect_cfe_from_links(page, link_selector: Optional[str] = None, output_fil
     # ---- After finishing collection, optionally navigate back to consulta and refill the same details ----
     if do_post_action:
         try:
-            try:
-                tipo = getattr(config, "ECF_TIPO", None)
-                d_from = getattr(config, "ECF_FROM_DATE", None)
-                d_to = getattr(config, "ECF_TO_DATE", None)
-            except Exception:
-                tipo = d_from = d_to = None
+            if cfg is not None:
+                tipo, d_from, d_to = cfg.tipo, cfg.date_from, cfg.date_to
+            else:
+                try:
+                    tipo = getattr(config, "ECF_TIPO", None)
+                    d_from = getattr(config, "ECF_FROM_DATE", None)
+                    d_to = getattr(config, "ECF_TO_DATE", None)
+                except Exception:
+                    tipo = d_from = d_to = None
 
             print("[INFO] Performing post-collection action: navigate to consulta and refill filters + click next image...")
             try:
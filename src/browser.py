@@ -0,0 +1,250 @@
+# src/browser.py
+import os
+import atexit
+import functools
+import logging
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from src import config
+
+logger = logging.getLogger('efactura.browser')
+
+# Playwright drivers + Chromiums, reused across run() calls in the same process.
+# Sync Playwright objects are bound to the thread that created them, so a small pool of
+# long-lived worker threads owns them: each worker keeps its own driver/browser in
+# _LOCAL, and jobs handed over with run_in_browser_thread() get a fresh BrowserContext.
+# The pool grows on demand up to config.BROWSER_WORKERS; further jobs wait in _JOBS.
+_LOCAL = threading.local()
+_JOBS = queue.SimpleQueue()
+_WORKERS = []
+_IDLE_WORKERS = 0
+_WORKER_LOCK = threading.Lock()
+# persistent profile folder -> lock; Chromium refuses a user data dir that is already open
+_PROFILE_LOCKS = {}
+
+# Headless scraping flags: no GPU/audio/extensions, no background throttling of
+# the scraper's tabs, /tmp instead of the (often tiny) container /dev/shm, and no
+# Chrome-internal background traffic (sync, metrics upload, default apps).
+CHROMIUM_ARGS = [
+    "--disable-gpu",
+    "--disable-dev-shm-usage",
+    "--disable-backgrounding-occluded-windows",
+    "--disable-renderer-backgrounding",
+    "--disable-background-timer-throttling",
+    "--no-sandbox",
+    "--mute-audio",
+    "--no-first-run",
+    "--disable-extensions",
+    "--disable-breakpad",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--metrics-recording-only",
+    "--disable-default-apps",
+]
+
+# Subresources the scraper never reads, by resource type (config.BLOCKED_RESOURCE_TYPES).
+# Stylesheets are not blocked by default: GeneXus hides menu entries/grid controls via
+# CSS, and the text/visibility selectors rely on that.
+# All of it is dropped inside Chromium (CDP Network.setBlockedURLs), so no request is
+# intercepted in Python. A blocked image still renders its alt text / broken-image box,
+# so <input type=image> buttons (Next page, Export XLS) keep a clickable area.
+RESOURCE_URL_PATTERNS = {
+    "image": [p for ext in ("png", "jpg", "jpeg", "gif", "svg", "ico", "webp", "bmp")
+              for p in (f"*.{ext}", f"*.{ext}?*")],
+    "font": ["*.woff*", "*.ttf*", "*.otf*", "*.eot*"],
+    "media": ["*.mp4*", "*.webm*", "*.mp3*", "*.ogg*", "*.wav*"],
+    "stylesheet": ["*.css*"],
+}
+# third-party trackers, always blocked
+ANALYTICS_URL_PATTERNS = [
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*hotjar.com*",
+]
+# pages that already have their CDP blocking session (new_blocked_page + the context's "page" hook)
+_BLOCKED_PAGES = weakref.WeakSet()
+
+
+def _launch(p, headless: bool):
+    cdp_endpoint = os.environ.get("PLAYWRIGHT_CDP")
+    if cdp_endpoint:
+        logger.info('Connecting to existing Chromium over CDP: %s', cdp_endpoint)
+        return p.chromium.connect_over_cdp(cdp_endpoint)
+    return p.chromium.launch(headless=headless, args=CHROMIUM_ARGS, slow_mo=config.get_slow_mo())
+
+
+def _shutdown():
+    """Close this worker's browser and stop its driver subprocess (worker thread only)."""
+    browser = getattr(_LOCAL, "browser", None)
+    pw = getattr(_LOCAL, "pw", None)
+    try:
+        if browser is not None:
+            browser.close()
+    except Exception:
+        pass
+    try:
+        if pw is not None:
+            pw.stop()
+    except Exception:
+        pass
+    _LOCAL.browser = _LOCAL.pw = None
+
+
+def _worker_loop():
+    global _IDLE_WORKERS
+    _LOCAL.worker = True
+    while True:
+        with _WORKER_LOCK:
+            _IDLE_WORKERS += 1
+        item = _JOBS.get()
+        with _WORKER_LOCK:
+            _IDLE_WORKERS -= 1
+        if item is None:
+            break
+        fn, args, kwargs, fut, queued_at = item
+        if not fut.set_running_or_notify_cancel():
+            continue
+        logger.info('[PERF] browser job waited %.0f ms in queue', (time.perf_counter() - queued_at) * 1000)
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            fut.set_exception(e)
+    _shutdown()
+
+
+def _stop_workers():
+    """atexit hook: let each worker thread close the browser/driver it owns."""
+    workers = [w for w in _WORKERS if w.is_alive()]
+    for _ in workers:
+        _JOBS.put(None)
+    for w in workers:
+        w.join(timeout=30)
+
+
+def in_browser_thread() -> bool:
+    return getattr(_LOCAL, "worker", False)
+
+
+def run_in_browser_thread(fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) on a Playwright worker thread and return its result, re-raising
+    its exception. Calls from a worker itself run inline.
+    Raises concurrent.futures.TimeoutError when the job (queue time included) takes longer
+    than config.BROWSER_JOB_TIMEOUT; a job that already started keeps running on its worker.
+    """
+    if in_browser_thread():
+        return fn(*args, **kwargs)
+    with _WORKER_LOCK:
+        # start another worker only when every existing one is busy or already claimed
+        if len(_WORKERS) < config.get_browser_workers() and _IDLE_WORKERS <= _JOBS.qsize():
+            if not _WORKERS:
+                atexit.register(_stop_workers)
+            w = threading.Thread(target=_worker_loop, name=f"playwright-{len(_WORKERS) + 1}", daemon=True)
+            _WORKERS.append(w)
+            w.start()
+    fut = Future()
+    _JOBS.put((fn, args, kwargs, fut, time.perf_counter()))
+    try:
+        return fut.result(timeout=config.get_browser_job_timeout() or None)
+    except FutureTimeoutError:
+        if fut.cancel():
+            logger.error('Browser job timed out waiting for a free worker')
+        else:
+            logger.error('Browser job timed out; it keeps running on its worker until it finishes')
+        raise
+
+
+def persistent_profile_lock(user_data_dir) -> threading.Lock:
+    """Lock serializing the jobs that open the same persistent profile folder."""
+    key = os.path.abspath(str(user_data_dir))
+    with _WORKER_LOCK:
+        return _PROFILE_LOCKS.setdefault(key, threading.Lock())
+
+
+def _get_playwright():
+    """Start this worker's Playwright driver once (non-context-manager API) and reuse it."""
+    if not in_browser_thread():
+        raise RuntimeError("Playwright objects are owned by the browser workers; use run_in_browser_thread()")
+    pw = getattr(_LOCAL, "pw", None)
+    if pw is None:
+        from playwright.sync_api import sync_playwright
+        pw = _LOCAL.pw = sync_playwright().start()
+    return pw
+
+
+def get_or_launch_browser(headless: bool = True):
+    """
+    Return this worker's shared browser, launched on first use and relaunched if it
+    disconnected (or connected over CDP when PLAYWRIGHT_CDP is set).
+    Must be called on a browser worker thread (see run_in_browser_thread).
+    """
+    pw = _get_playwright()
+    browser = getattr(_LOCAL, "browser", None)
+    # relaunch if Chromium crashed or the CDP endpoint went away between runs
+    if browser is None or not browser.is_connected():
+        browser = _LOCAL.browser = _launch(pw, headless)
+    return browser
+
+
+def launch_persistent_context(user_data_dir, headless: bool = True, **kwargs):
+    """
+    Return a BrowserContext for a Chromium profile kept on disk at user_data_dir, so the
+    HTTP cache and cookies carry over to the next run; the caller closes it, which also
+    closes the Chromium launched for it (the shared browser is not used).
+    Must be called on a browser worker thread. Only one browser can use a given profile
+    directory at a time (see persistent_profile_lock).
+    """
+    return _get_playwright().chromium.launch_persistent_context(
+        str(user_data_dir), headless=headless, args=CHROMIUM_ARGS, slow_mo=config.get_slow_mo(), **kwargs
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def _url_patterns_for(blocked_types: str) -> tuple:
+    # memoized per setting value, so each unsupported type is reported once, not per tab
+    patterns = list(ANALYTICS_URL_PATTERNS)
+    for t in sorted({t.strip().lower() for t in blocked_types.split(",") if t.strip()}):
+        if t not in RESOURCE_URL_PATTERNS:
+            logger.warning('BLOCKED_RESOURCE_TYPES: ignoring unsupported type %r (supported: %s)',
+                           t, ", ".join(RESOURCE_URL_PATTERNS))
+            continue
+        patterns.extend(RESOURCE_URL_PATTERNS[t])
+    return tuple(patterns)
+
+
+def _blocked_url_patterns() -> list:
+    return list(_url_patterns_for(str(config.BLOCKED_RESOURCE_TYPES)))
+
+
+def _apply_cdp_blocking(ctx, page, patterns):
+    if page in _BLOCKED_PAGES:
+        return
+    _BLOCKED_PAGES.add(page)
+    try:
+        client = ctx.new_cdp_session(page)
+        client.send("Network.enable", {})
+        client.send("Network.setBlockedURLs", {"urls": patterns})
+    except Exception as e:
+        logger.warning('CDP resource blocking unavailable: %s', e)
+
+
+def block_heavy_resources(ctx):
+    """
+    Skip the resource types listed in config.BLOCKED_RESOURCE_TYPES (images, fonts and
+    media by default) and analytics trackers for the pages of the job's context, blocked
+    per page over CDP: existing pages now, tabs/popups the site opens as they appear.
+    Open the scraper's own tabs with new_blocked_page() so their first goto is covered.
+    """
+    patterns = _blocked_url_patterns()
+    for page in ctx.pages:
+        _apply_cdp_blocking(ctx, page, patterns)
+    ctx.on("page", lambda page: _apply_cdp_blocking(ctx, page, patterns))
+
+
+def new_blocked_page(ctx):
+    """Open a tab in ctx with resource blocking already in place, before its first navigation."""
+    page = ctx.new_page()
+    _apply_cdp_blocking(ctx, page, _blocked_url_patterns())
+    return page
@@ -1,15 +1,50 @@
 # src/config.py
 import os
-from dotenv import load_dotenv
+import re
+import functools
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
+
+_INLINE_COMMENT = re.compile(r'\s+#.*$')
+
+def _parse_env_file(path) -> dict:
+    """
+    Minimal .env parser for the simple KEY=VALUE lines this project uses.
+    Blank lines and '#' comments are skipped, as are inline comments after unquoted
+    values (KEY=value  # note); matching surrounding quotes are stripped.
+    No variable expansion or multi-line values.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    values = {}
+    for raw in data.splitlines():
+        line = raw.strip()
+        if not line or line[:1] == b'#' or b'=' not in line:
+            continue
+        k, _, v = line.partition(b'=')
+        k = k.strip().decode('utf-8')
+        v = v.strip().decode('utf-8')
+        if k.startswith('export '):
+            k = k[len('export '):].strip()
+        end = v.find(v[0], 1) if v[:1] in ('"', "'") else -1
+        if end > 0:
+            # quoted value; anything after the closing quote (e.g. a comment) is dropped
+            v = v[1:end]
+        else:
+            # unquoted values end at an inline ' # comment' (python-dotenv semantics)
+            v = _INLINE_COMMENT.sub('', v)
+        if k:
+            values[k] = v
+    return values
 
 # Load .env if present (optional)
 BASE_DIR = Path(__file__).resolve().parents[1]
 ENV_PATH = BASE_DIR / '.env'
-if ENV_PATH.exists():
-    load_dotenv(dotenv_path=str(ENV_PATH), override=True)
-else:
-    load_dotenv(override=False)
+# No fallback search when it is missing: deployed runs get their settings from the real environment.
+if ENV_PATH.is_file():
+    # project .env wins over the inherited environment (same as load_dotenv(override=True))
+    os.environ.update(_parse_env_file(ENV_PATH))
 
 def _bool(v, default=False):
     if v is None:
@@ -17,64 +52,163 @@ def _bool(v, default=False):
     v = str(v).lower()
     return v in ("1", "true", "yes", "y", "on")
 
-# default values (read from environment if present)
-
-# Root output directory (new): will contain per-RUT folders
-OUTPUT_DIR = os.getenv('OUTPUT_DIR', 'output')
-
-# Backwards-compatible single-file output path.
-# If not provided explicitly, it will be placed inside OUTPUT_DIR.
-_tmp_output_file = os.getenv('OUTPUT_FILE', None)
-if _tmp_output_file:
-    OUTPUT_FILE = _tmp_output_file
-else:
-    OUTPUT_FILE = os.path.join(OUTPUT_DIR, 'results.xlsx')
-
-RUT = os.getenv('RUT', '')
-CLAVE = os.getenv('CLAVE', '')
-START_URL = os.getenv('START_URL', 'https://servicios.dgi.gub.uy/serviciosenlinea')
-HEADLESS = _bool(os.getenv('HEADLESS', 'true'))
-ECF_TIPO = os.getenv('ECF_TIPO', '111')
-ECF_FROM_DATE = os.getenv('ECF_FROM_DATE', '')
-ECF_TO_DATE = os.getenv('ECF_TO_DATE', '')
-# downloads folder for browser downloads (separate from OUTPUT_DIR)
-DOWNLOAD_DIR = os.getenv('DOWNLOAD_DIR', 'downloads')
-
-# MAX_PAGES safe parsing
-try:
-    MAX_PAGES = int(os.getenv('MAX_PAGES')) if os.getenv('MAX_PAGES') else None
-except Exception:
-    MAX_PAGES = None
-
-def override_from_dict(d: dict):
+def _int_or_none(v):
+    """Parse an integer setting without raising; malformed or empty values give None."""
+    if v is None:
+        return None
+    v = str(v).strip()
+    # ASCII digits only: str.isdigit() also accepts e.g. '²', which int() rejects
+    return int(v) if re.fullmatch(r'-?[0-9]+', v) else None
+
+# Typed accessors for process-wide settings: read os.environ once and memoize.
+# refresh() clears the caches after re-reading .env.
+@functools.cache
+def get_slow_mo() -> int:
+    # per-action delay in ms for watching a headed debug run; 0 (off) unless set
+    return max(_int_or_none(os.environ.get('PLAYWRIGHT_SLOW_MO')) or 0, 0)
+
+@functools.cache
+def get_storage_state_ttl() -> int:
+    # seconds a saved login (storage_state) is reused before logging in again
+    v = _int_or_none(os.environ.get('STORAGE_STATE_TTL'))
+    return 1800 if v is None else v
+
+@functools.cache
+def get_max_concurrency(default: int = 2) -> int:
+    # detail pages in flight at once per grid page (browser tabs or HTTP workers);
+    # when MAX_CONCURRENCY is unset each fetch path passes its own default
+    return max(_int_or_none(os.environ.get('MAX_CONCURRENCY')) or default, 1)
+
+@functools.cache
+def get_browser_workers() -> int:
+    # browser worker threads, each owning one Playwright driver + Chromium; more jobs queue up
+    return max(_int_or_none(os.environ.get('BROWSER_WORKERS')) or 2, 1)
+
+@functools.cache
+def get_browser_job_timeout() -> int:
+    # seconds a caller waits for its browser job, queue time included; 0 = no limit
+    v = _int_or_none(os.environ.get('BROWSER_JOB_TIMEOUT'))
+    return 1800 if v is None else max(v, 0)
+
+@functools.cache
+def get_debug() -> bool:
+    # development aids (startup screenshot etc.); off in production
+    return _bool(os.environ.get('EFACTURA_DEBUG'))
+
+# Defaults for plain string settings. os.environ is the single source of truth:
+# module attributes (config.RUT, config.CONSULTA_URL, ...) are resolved on read by __getattr__.
+_DEFAULTS = {
+    # Root output directory (new): will contain per-RUT folders
+    'OUTPUT_DIR': 'output',
+    'RUT': '',
+    'CLAVE': '',
+    'START_URL': 'https://servicios.dgi.gub.uy/serviciosenlinea',
+    # Consulta de CFE recibidos page (opened directly when a saved login is reused)
+    'CONSULTA_URL': 'https://servicios.dgi.gub.uy/serviciosenlinea/con-clave/dgi--servicios-en-linea--otros-servicios--efactura-consulta-de-cfe-y-cfc-recibidos',
+    'ECF_TIPO': '111',
+    'ECF_FROM_DATE': '',
+    'ECF_TO_DATE': '',
+    # downloads folder for browser downloads (separate from OUTPUT_DIR)
+    'DOWNLOAD_DIR': 'downloads',
+    # folder for rotating log files (see src/logger.py)
+    'LOG_DIR': 'logs',
+    'LOG_LEVEL': 'INFO',
+    # how grid detail pages are fetched: 'browser' (default), 'nojs'
+    # (separate JavaScript-disabled context sharing the login cookies) or 'http'
+    # (requests.Session with the login cookies; browser fallback per page)
+    'DETAIL_FETCH': 'browser',
+    # optional Chromium profile root (persistent context, one subfolder per RUT+CLAVE) that
+    # keeps the HTTP cache and cookies between runs, at the cost of a Chromium launch per run;
+    # empty = shared browser with a fresh context per run
+    'BROWSER_PROFILE_DIR': '',
+    # comma-separated resource types skipped by every browser context; supported: image,
+    # font, media, stylesheet (anything else is ignored with a warning). Stylesheets are
+    # off by default since GeneXus toggles controls via CSS
+    'BLOCKED_RESOURCE_TYPES': 'image,font,media',
+    # directory for saved logins (Playwright storage_state, one file per RUT+CLAVE);
+    # empty = .cache
+    'STORAGE_STATE': '',
+}
+
+# attribute name -> memoized accessor (cleared by refresh)
+_ACCESSORS = {
+    'EFACTURA_DEBUG': get_debug,
+    'PLAYWRIGHT_SLOW_MO': get_slow_mo,
+    'STORAGE_STATE_TTL': get_storage_state_ttl,
+    'MAX_CONCURRENCY': get_max_concurrency,
+    'BROWSER_WORKERS': get_browser_workers,
+    'BROWSER_JOB_TIMEOUT': get_browser_job_timeout,
+}
+
+def __getattr__(name):
+    accessor = _ACCESSORS.get(name)
+    if accessor is not None:
+        return accessor()
+    if name in _DEFAULTS:
+        return os.environ.get(name, _DEFAULTS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def refresh():
     """
-    Apply overrides at runtime (in-memory). Does not write .env file.
-    Keys should match the uppercase config names.
+    Re-apply the project .env (if present) and drop memoized values, without re-importing
+    this module. Runtime overrides for keys that are not in .env stay in effect.
     """
-    global OUTPUT_DIR, OUTPUT_FILE, HEADLESS, MAX_PAGES
+    if ENV_PATH.is_file():
+        os.environ.update(_parse_env_file(ENV_PATH))
+    for accessor in _ACCESSORS.values():
+        accessor.cache_clear()
 
-    for k, v in d.items():
-        if v is None:
-            continue
-        kk = str(k).strip()
-        kk_norm = kk.upper()
-        os.environ[kk_norm] = str(v)
-        # write into module globals so callers reading config.<NAME> get the update
-        globals()[kk_norm] = v
-
-    # If OUTPUT_DIR was set via overrides but OUTPUT_FILE was not, update OUTPUT_FILE default
-    if 'OUTPUT_DIR' in os.environ and not os.environ.get('OUTPUT_FILE'):
-        OUTPUT_DIR = os.environ.get('OUTPUT_DIR')
-        OUTPUT_FILE = os.path.join(OUTPUT_DIR, 'results.xlsx')
-
-    # ensure HEADLESS interpreted to boolean
-    if 'HEADLESS' in os.environ:
-        val = os.environ.get('HEADLESS')
-        globals()['HEADLESS'] = str(val).lower() in ("1", "true", "yes", "y", "on")
-
-    # ensure MAX_PAGES is integer or None
-    if 'MAX_PAGES' in os.environ:
-        try:
-            globals()['MAX_PAGES'] = int(os.environ.get('MAX_PAGES'))
-        except Exception:
-            globals()['MAX_PAGES'] = None
+@dataclass(frozen=True)
+class RunConfig:
+    """Per-job settings, resolved once and passed explicitly (run(cfg=...)) instead of read from globals."""
+    rut: str
+    clave: str
+    tipo: str
+    date_from: str
+    date_to: str
+    max_pages: Optional[int] = None
+    output_file: str = ''
+    download_dir: str = ''
+    detail_fetch: str = 'browser'
+    max_concurrency: Optional[int] = None
+
+# the only keys a job (e.g. an uploaded file) may override; everything else is a
+# process-wide setting taken from the server's environment / .env
+RUN_CONFIG_KEYS = frozenset((
+    'RUT', 'CLAVE', 'ECF_TIPO', 'ECF_FROM_DATE', 'ECF_TO_DATE', 'MAX_PAGES',
+    'OUTPUT_FILE', 'OUTPUT_DIR', 'DOWNLOAD_DIR', 'DETAIL_FETCH', 'MAX_CONCURRENCY',
+))
+
+def _output_file(get) -> str:
+    # Backwards-compatible single-file output path.
+    # If not provided explicitly, it will be placed inside OUTPUT_DIR.
+    return get('OUTPUT_FILE') or os.path.join(get('OUTPUT_DIR'), 'results.xlsx')
+
+def run_config(overrides: Optional[dict] = None) -> RunConfig:
+    """
+    Build a RunConfig from the environment (.env included) with overrides applied on top;
+    override keys outside RUN_CONFIG_KEYS are ignored.
+    Nothing is written to os.environ, so concurrent jobs (e.g. Flask requests) never see
+    each other's credentials or dates.
+    """
+    o = {str(k).strip().upper(): str(v) for k, v in (overrides or {}).items() if v is not None}
+    o = {k: v for k, v in o.items() if k in RUN_CONFIG_KEYS}
+
+    def get(k, default=None):
+        if k in o:
+            return o[k]
+        return os.environ.get(k, _DEFAULTS.get(k, '') if default is None else default)
+
+    # paths are resolved to absolute strings once, so callers never re-resolve them
+    return RunConfig(
+        rut=get('RUT'),
+        clave=get('CLAVE'),
+        tipo=get('ECF_TIPO'),
+        date_from=get('ECF_FROM_DATE'),
+        date_to=get('ECF_TO_DATE'),
+        max_pages=_int_or_none(get('MAX_PAGES')),
+        output_file=os.path.abspath(_output_file(get)),
+        download_dir=os.path.abspath(get('DOWNLOAD_DIR')),
+        detail_fetch=get('DETAIL_FETCH').strip().lower(),
+        max_concurrency=_int_or_none(get('MAX_CONCURRENCY')),
+    )
@@ -0,0 +1,91 @@
+# src/logger.py
+import os
+import time
+import atexit
+import queue
+import logging
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+from src import config
+
+LOG_DIR = getattr(config, "LOG_DIR", "logs")
+LOG_FILE = os.path.join(LOG_DIR, "scraper.log")
+
+_listener = None
+_logger = None
+# first get_logger() calls can race (Flask request threads, browser workers)
+_build_lock = threading.Lock()
+
+
+class _FastFormatter(logging.Formatter):
+    """
+    Formatter with a fixed 'asctime | level | name | message' layout.
+    Skips %-style substitution and caches the timestamp string per wall-clock second.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._last_sec = -1
+        self._asctime_cache = ""
+
+    def format(self, record):
+        sec = int(record.created)
+        if sec != self._last_sec:
+            self._last_sec = sec
+            self._asctime_cache = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        line = f"{self._asctime_cache} | {record.levelname:<7} | {record.name} | {record.getMessage()}"
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line = f"{line}\n{record.exc_text}"
+        return line
+
+
+def _build_logger(name: str = "efactura") -> logging.Logger:
+    """
+    Build the shared 'efactura' logger.
+    The logger itself only enqueues records (QueueHandler); formatting and file/console IO
+    happen on the QueueListener thread so log calls never block the scraper on disk writes.
+    """
+    global _listener
+    logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
+
+    # created here (not at import) so processes that never log don't touch the filesystem
+    if not os.path.isdir(LOG_DIR):
+        os.makedirs(LOG_DIR, exist_ok=True)
+
+    logger.setLevel(str(getattr(config, "LOG_LEVEL", "INFO")).upper())
+    logger.propagate = False
+
+    file_fmt = _FastFormatter()
+    console_fmt = _FastFormatter()
+
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8")
+    file_handler.setFormatter(file_fmt)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(console_fmt)
+
+    q = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(q))
+    _listener = QueueListener(q, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    # flush pending records on interpreter exit
+    atexit.register(_listener.stop)
+    return logger
+
+
+def get_logger(name: str = "") -> logging.Logger:
+    """
+    Return the shared logger, or a named child of it (e.g. 'main' -> 'efactura.main').
+    Handlers are built on the first call.
+    """
+    global _logger
+    if _logger is None:
+        with _build_lock:
+            # re-check under the lock so only one caller attaches handlers/starts the listener
+            if _logger is None:
+                _logger = _build_logger()
+    return _logger.getChild(name) if name else _logger
@@ -1,116 +1,268 @@
 # src/main.py — updated to always run headless and not pause
 import time
+import logging
+from contextlib import contextmanager
 from pathlib import Path
-from playwright.sync_api import sync_playwright
-import importlib
 import os
 
-from src import auth
-from src import selectors as sel
+from src import config
+from src.browser import (
+    get_or_launch_browser, launch_persistent_context, persistent_profile_lock,
+    block_heavy_resources, new_blocked_page, in_browser_thread, run_in_browser_thread,
+)
+from src.logger import get_logger
 
-def run():
+# handlers are attached by get_logger() on the first run(), not at import
+logger = logging.getLogger('efactura.main')
+
+_MASK = '*' * 64
+
+def mask_secret(s: str) -> str:
+    """Mask a secret for display: keep first/last char of long values, hide short ones entirely."""
+    if not s:
+        return ''
+    if len(s) < 8:
+        return _MASK[:len(s)]
+    return f"{s[0]}{_MASK[:len(s) - 2]}{s[-1]}"
+
+@contextmanager
+def phase(name: str, timings: dict = None):
+    """Time a block with perf_counter: logs '[PERF] <name> <ms>ms' and adds it to timings."""
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t) * 1000
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + ms
+        logger.info('[PERF] %s %.0fms', name, ms)
+
+def _log_run_banner(cfg, headless: bool):
+    """Log the effective job settings as a single record (skipped, masking included, below INFO)."""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info(
+        "Run configuration:\n"
+        f"  RUT           : {cfg.rut}\n"
+        f"  CLAVE         : {mask_secret(cfg.clave)}\n"
+        f"  ECF_TIPO      : {cfg.tipo}\n"
+        f"  ECF_FROM_DATE : {cfg.date_from}\n"
+        f"  ECF_TO_DATE   : {cfg.date_to}\n"
+        f"  MAX_PAGES     : {cfg.max_pages}\n"
+        f"  OUTPUT_FILE   : {cfg.output_file}\n"
+        f"  DOWNLOAD_DIR  : {cfg.download_dir}\n"
+        f"  HEADLESS      : {headless}"
+    )
+
+def run(browser=None, cfg=None):
     """
     Run the Playwright scraping job. Always runs headless (no UI) and does not pause.
+    Pass an existing Browser to reuse it (the job then runs on the calling thread). Otherwise
+    the job is handed to a src.browser worker thread and uses that worker's shared browser,
+    or a persistent per-login Chromium profile when BROWSER_PROFILE_DIR is set; up to
+    BROWSER_WORKERS such jobs run at once, and jobs for the same profile one at a time.
+    Each call works in its own BrowserContext, which is closed at the end of the job.
+    cfg is the job's config.RunConfig (credentials, dates, output paths, detail fetch mode and
+    concurrency); defaults to config.run_config(), i.e. the current environment.
     Raises ValueError for login failures propagated from auth.login_and_continue.
     """
-    # reload config module so runtime overrides are picked up
-    import src.config as config
-    importlib.reload(config)
-
-    # Only apply these five keys from environment (if provided).
-    allowed_override_keys = ['RUT', 'CLAVE', 'ECF_TIPO', 'ECF_FROM_DATE', 'ECF_TO_DATE']
-    for k in allowed_override_keys:
-        v = os.getenv(k)
-        if v is not None:
-            try:
-                setattr(config, k, v)
-            except Exception:
-                pass
+    get_logger()  # builds the shared log handlers once
+    # Job settings come from cfg; src.config is only read for process-wide tuning knobs.
+    if cfg is None:
+        cfg = config.run_config()
 
-    Path(config.DOWNLOAD_DIR).mkdir(parents=True, exist_ok=True)
-    Path(Path(config.OUTPUT_FILE).parent).mkdir(parents=True, exist_ok=True)
+    # fail fast, before any browser/driver work, when credentials are missing
+    if not cfg.rut.strip() or not cfg.clave.strip():
+        raise ValueError("RUT and CLAVE are required (set them in the uploaded file or the environment).")
 
-    # force headless True to prevent visible browser
-    headless = True
+    # Playwright objects live on the browser worker threads (src.browser): hand the job over
+    if browser is None and not in_browser_thread():
+        return run_in_browser_thread(run, cfg=cfg)
 
-    print(f"[INFO] Launching browser (headless={headless})")
-    with sync_playwright() as p:
-        slow_mo = 0
-        browser = p.chromium.launch(headless=headless, slow_mo=slow_mo)
-        ctx = browser.new_context(accept_downloads=True)
-        page = ctx.new_page()
+    # imported here so validation failures (and importing src.main) skip Playwright/pandas
+    from src import auth
+    from src import selectors as sel
 
-        login_url = getattr(config, "START_URL", "https://servicios.dgi.gub.uy/serviciosenlinea")
-        print('[INFO] Navigating to', login_url)
-        try:
-            page.goto(login_url, wait_until='networkidle', timeout=60000)
-        except Exception as e:
-            print('[WARN] initial goto failed or timed out:', e)
+    # create each output folder once per process (auth.ensure_dir remembers what it created)
+    for d in (cfg.download_dir, os.path.dirname(cfg.output_file), 'debug' if config.get_debug() else None):
+        if d:
+            auth.ensure_dir(d)
 
-        try:
-            Path('debug').mkdir(parents=True, exist_ok=True)
-            page.screenshot(path='debug/after_goto.png', full_page=True)
-            print('[INFO] Saved debug screenshot: debug/after_goto.png')
-        except Exception as e:
-            print('[WARN] Could not save screenshot:', e)
+    # force headless True to prevent visible browser
+    headless = True
 
-        # perform login and navigate to Consulta de CFE recibidos
+    _log_run_banner(cfg, headless)
+    logger.info('Acquiring browser (headless=%s)', headless)
+    state_path = state_file = None
+    profile_lock = None
+    timings = {}
+    if browser is None and config.BROWSER_PROFILE_DIR:
+        # on-disk profile per login (sanitized RUT + salted CLAVE hash): HTTP cache and cookies
+        # survive between runs, and a wrong CLAVE gets a fresh profile and a real login.
+        # Closing a persistent context closes its Chromium, so every run pays a browser launch.
+        profile_root = config.BROWSER_PROFILE_DIR
+        profile_dir = Path(profile_root) / f"rut_{auth.credential_key(cfg.rut, cfg.clave, profile_root)}"
+        # workers run jobs in parallel: a second job for the same login waits for the folder
+        profile_lock = persistent_profile_lock(profile_dir)
+        profile_lock.acquire()
         try:
-            final_page, final_url = auth.login_and_continue(page, post_click_wait=5, wait_for_selector=sel.SELECT_TIPO_CFE)
-            print('[INFO] Reached', final_url)
-        except ValueError:
-            # login failure (auth raised ValueError) - propagate to caller
+            with phase('browser', timings):
+                ctx = launch_persistent_context(profile_dir, headless=headless, accept_downloads=True)
+        except BaseException:
+            profile_lock.release()
             raise
+        browser = ctx.browser
+    else:
+        if browser is None:
+            with phase('browser', timings):
+                browser = get_or_launch_browser(headless=headless)
+        state_path = auth.storage_state_path(cfg.rut, cfg.clave, config.STORAGE_STATE or '.cache')
+        state_file = auth.fresh_storage_state(state_path, config.get_storage_state_ttl())
+        try:
+            ctx = browser.new_context(accept_downloads=True, storage_state=state_file)
         except Exception as e:
-            print('[ERROR] login_and_continue failed:', e)
+            if state_file is None:
+                raise
+            # unreadable saved login (truncated/corrupt JSON): drop it and log in from scratch
+            logger.warning('Discarding saved login that could not be loaded: %s', e)
+            state_path.unlink(missing_ok=True)
+            state_file = None
+            ctx = browser.new_context(accept_downloads=True)
+    detail_ctx = None
+    http_session = None
+    try:
+        block_heavy_resources(ctx)
+        # context-wide defaults; per-call timeouts are only passed where a step needs a different bound
+        ctx.set_default_navigation_timeout(20000)
+        ctx.set_default_timeout(10000)
+        page = ctx.pages[0] if ctx.pages else new_blocked_page(ctx)
+
+        # reuse the saved login (storage_state file or profile cookies) while it is still valid;
+        # the probe falls through to a full login
+        final_page = None
+        if state_file or state_path is None:
+            with phase('resume_session', timings):
+                resumed = auth.resume_session(page, config.CONSULTA_URL)
+            if resumed:
+                final_page = page
+                logger.info('Reused saved session: %s', page.url)
+            elif state_file:
+                # expired on the server side: drop it so later runs don't probe it again
+                state_path.unlink(missing_ok=True)
+
+        if final_page is None:
+            login_url = getattr(config, "START_URL", "https://servicios.dgi.gub.uy/serviciosenlinea")
+            logger.info('Navigating to %s', login_url)
             try:
-                browser.close()
-            except Exception:
-                pass
-            return
+                with phase('goto', timings):
+                    page.goto(login_url, wait_until='domcontentloaded')
+            except Exception as e:
+                logger.warning('initial goto failed or timed out: %s', e)
+            try:
+                # wait for the login form itself instead of network quiet
+                page.wait_for_selector(sel.LOGIN_READY, state='visible', timeout=15000)
+            except Exception as e:
+                logger.warning('login form not visible yet: %s', e)
+                try:
+                    page.wait_for_load_state('load', timeout=15000)
+                except Exception:
+                    pass
+
+            if config.get_debug():
+                try:
+                    # viewport-only JPEG: a fraction of the render/encode cost of a full-page PNG
+                    page.screenshot(path='debug/after_goto.jpg', full_page=False, type='jpeg', quality=60)
+                    logger.info('Saved debug screenshot: debug/after_goto.jpg')
+                except Exception as e:
+                    logger.warning('Could not save screenshot: %s', e)
+
+            # perform login and navigate to Consulta de CFE recibidos
+            try:
+                with phase('login', timings):
+                    final_page, final_url = auth.login_and_continue(page, post_click_wait=0, wait_for_selector=sel.SELECT_TIPO_CFE, cfg=cfg)
+                logger.info('Reached %s', final_url)
+            except ValueError:
+                # login failure (auth raised ValueError) - propagate to caller
+                raise
+            except Exception as e:
+                logger.error('login_and_continue failed: %s', e)
+                return
+            if state_path is not None:
+                auth.save_storage_state(ctx, state_path)
 
         # Optionally fill the tipo/date and click consultar
         try:
-            final_page, results_url = auth.fill_cfe_and_consult(
-                final_page,
-                tipo_value=config.ECF_TIPO,
-                date_from=config.ECF_FROM_DATE,
-                date_to=config.ECF_TO_DATE,
-                wait_after_result=3
-            )
-            print('[INFO] Results page URL:', results_url)
+            with phase('fill_cfe_and_consult', timings):
+                final_page, results_url = auth.fill_cfe_and_consult(
+                    final_page,
+                    tipo_value=cfg.tipo,
+                    date_from=cfg.date_from,
+                    date_to=cfg.date_to,
+                    wait_after_result=0
+                )
+            logger.info('Results page URL: %s', results_url)
         except Exception as e:
-            print('[WARN] fill_cfe_and_consult failed:', e)
+            logger.warning('fill_cfe_and_consult failed: %s', e)
 
 
+        # Detail pages are server-rendered: optionally fetch them in a JavaScript-disabled
+        # context that reuses the login cookies (the grid itself keeps JS for paging/export).
+        detail_fetch = cfg.detail_fetch
+        if detail_fetch == 'nojs' and browser is None:
+            logger.warning('DETAIL_FETCH=nojs needs a Browser; not available with BROWSER_PROFILE_DIR')
+        elif detail_fetch == 'nojs':
+            try:
+                detail_ctx = browser.new_context(java_script_enabled=False, storage_state=ctx.storage_state())
+                block_heavy_resources(detail_ctx)
+                detail_ctx.set_default_navigation_timeout(20000)
+                detail_ctx.set_default_timeout(10000)
+            except Exception as e:
+                logger.warning('Could not create JavaScript-disabled context: %s', e)
+                detail_ctx = None
+        elif detail_fetch == 'http':
+            try:
+                http_session = auth.build_http_session(final_page, max_concurrency=cfg.max_concurrency)
+            except Exception as e:
+                logger.warning('Could not create HTTP session for detail pages: %s', e)
+                http_session = None
+
         # Collect links from the results grid and extract fields
         try:
             link_selector = getattr(sel, "GRID_LINKS_SELECTOR", None)
             parent_selector = getattr(sel, "GRID_PARENT_SELECTOR", None)
-            out = auth.collect_cfe_from_links(
-                final_page,
-                link_selector=link_selector,
-                output_file=config.OUTPUT_FILE,
-                parent_selector=parent_selector,
-                do_post_action=False,
-                max_pages=getattr(config, "MAX_PAGES", None)
-            )
-            print('[INFO] Extraction saved to:', out)
+            with phase('collect_cfe_from_links', timings):
+                out = auth.collect_cfe_from_links(
+                    final_page,
+                    link_selector=link_selector,
+                    output_file=cfg.output_file,
+                    parent_selector=parent_selector,
+                    do_post_action=False,
+                    max_pages=cfg.max_pages,
+                    detail_context=detail_ctx,
+                    http_session=http_session,
+                    max_concurrency=cfg.max_concurrency,
+                    cfg=cfg
+                )
+            logger.info('Extraction saved to: %s', out)
         except Exception as e:
-            print('[ERROR] collect_cfe_from_links failed:', e)
+            logger.error('collect_cfe_from_links failed: %s', e)
 
         # Optional post action
         try:
-            tipo = getattr(config, "ECF_TIPO", None)
-            d_from = getattr(config, "ECF_FROM_DATE", None)
-            d_to = getattr(config, "ECF_TO_DATE", None)
+            with phase('post_action', timings):
+                auth.go_to_consulta_and_click_next(final_page, tipo_value=cfg.tipo, date_from=cfg.date_from, date_to=cfg.date_to, wait_after_fill=0)
+        except Exception as e:
+            logger.warning('Post-collection navigation/click failed: %s', e)
+    finally:
+        if http_session is not None:
+            http_session.close()
+        for c in (detail_ctx, ctx):
             try:
-                auth.go_to_consulta_and_click_next(final_page, tipo_value=tipo, date_from=d_from, date_to=d_to, wait_after_fill=2.0)
-            except Exception as e:
-                print('[WARN] Post-collection navigation/click failed:', e)
-        except Exception:
-            pass
-
-        browser.close()
-        print('[INFO] Browser closed. Done')
- 
\ No newline at end of file
+                if c is not None:
+                    c.close()
+            except Exception:
+                pass
+        if profile_lock is not None:
+            profile_lock.release()
+        logger.info('Browser context closed. Done')
+        logger.info('[PERF] summary (ms): %s', {k: round(v) for k, v in timings.items()})
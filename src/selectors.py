@@ -5,6 +5,8 @@ USERNAME_INPUT = 'input#logFld_885_73_2_1'
 PASSWORD_INPUT = 'input#logFld_885_73_2_2'
 LOGIN_BUTTON_IMG = 'img.logBtnLogin'
 CONTINUE_BUTTON = 'input[name="CONFIRMAR"][value="Continuar"]'
+LOGIN_IFRAME = 'iframe[src*="loginProd"]'                 # login form is sometimes embedded here
+LOGIN_READY = f'{USERNAME_INPUT}, {LOGIN_IFRAME}'         # first element the login flow needs
 
 # Consulta de CFE recibidos page selectors
 SELECT_TIPO_CFE = 'select#vFILTIPOCFE'            # dropdown for tipo CFE